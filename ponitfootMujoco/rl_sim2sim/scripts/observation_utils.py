@@ -0,0 +1,79 @@
+from numba import njit
+
+
+@njit(cache=True, fastmath=True)
+def fill_observation(row, quat, gyro, imu_offset_rot, joint_positions, joint_velocities, init_joint_angles,
+                     last_actions, commands, command_scales, gait_phase, gait_command,
+                     ang_vel_scale, dof_pos_scale, dof_vel_scale):
+    """
+    Writes one observation into a row of the history buffer. The fields are laid out as base
+    angular velocity, projected gravity, joint positions, joint velocities, actions, scaled
+    commands, gait phase and gait command.
+
+    Parameters:
+    row (np.ndarray): The history buffer row to write.
+    quat (np.ndarray): The IMU orientation as an (x, y, z, w) quaternion.
+    gyro (np.ndarray): The IMU angular velocity.
+    imu_offset_rot (np.ndarray): The 3x3 rotation from the IMU frame to the base frame.
+    """
+    # Rotate the gravity vector (0, 0, -1) into the base frame, using the closed form
+    # of the inverse rotation of the IMU quaternion
+    x, y, z, w = quat[0], quat[1], quat[2], quat[3]
+    s = 2.0 / (x * x + y * y + z * z + w * w)
+    gravity_x = s * (w * y - x * z)
+    gravity_y = -s * (y * z + w * x)
+    gravity_z = s * (x * x + y * y) - 1.0
+
+    for i in range(3):
+        row[i] = (imu_offset_rot[i, 0] * gyro[0] + imu_offset_rot[i, 1] * gyro[1] +
+                  imu_offset_rot[i, 2] * gyro[2]) * ang_vel_scale
+        row[3 + i] = (imu_offset_rot[i, 0] * gravity_x + imu_offset_rot[i, 1] * gravity_y +
+                      imu_offset_rot[i, 2] * gravity_z)
+    offset = 6
+
+    joint_num = joint_positions.shape[0]
+    for j in range(joint_num):
+        row[offset + j] = (joint_positions[j] - init_joint_angles[j]) * dof_pos_scale
+        row[offset + joint_num + j] = joint_velocities[j] * dof_vel_scale
+    offset += 2 * joint_num
+
+    for j in range(last_actions.shape[0]):
+        row[offset + j] = last_actions[j]
+    offset += last_actions.shape[0]
+
+    for i in range(3):
+        row[offset + i] = commands[i] * command_scales[i]
+        row[offset + 5 + i] = gait_command[i]
+    row[offset + 3] = gait_phase[0]
+    row[offset + 4] = gait_phase[1]
+
+
+@njit(cache=True, fastmath=True)
+def read_history(obs_buf, history_index, clip_observations, out):
+    """
+    Gathers the history buffer into the flat observation vector and clips it.
+
+    Parameters:
+    obs_buf (np.ndarray): The (history_length, obs_per_step) history buffer.
+    history_index (np.ndarray): The flat indices into obs_buf of each observation entry.
+    clip_observations (float): The observations are clipped to [-clip_observations, clip_observations].
+    out (np.ndarray): The observation vector to write.
+    """
+    flat_obs_buf = obs_buf.ravel()
+    for i in range(out.shape[0]):
+        out[i] = min(max(flat_obs_buf[history_index[i]], -clip_observations), clip_observations)
+
+
+@njit(cache=True, fastmath=True)
+def gather_history(obs_buf, history_index, out):
+    """
+    Gathers the history buffer into the flat observation vector, without clipping.
+
+    Parameters:
+    obs_buf (np.ndarray): The (history_length, obs_per_step) history buffer.
+    history_index (np.ndarray): The flat indices into obs_buf of each observation entry.
+    out (np.ndarray): The observation vector to write.
+    """
+    flat_obs_buf = obs_buf.ravel()
+    for i in range(out.shape[0]):
+        out[i] = flat_obs_buf[history_index[i]]
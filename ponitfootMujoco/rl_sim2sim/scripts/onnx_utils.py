@@ -0,0 +1,177 @@
+import os
+import hashlib
+import onnxruntime as ort
+
+
+def source_digest(*source_files, params=()):
+    """
+    Hashes the contents of the files a model is generated from, together with the parameters baked into it.
+
+    Parameters:
+    source_files (str): The files the model is generated from.
+    params (tuple): The parameters baked into the model.
+
+    Returns:
+    str: The hex sha256 digest.
+    """
+    digest = hashlib.sha256()
+    for source_file in source_files:
+        with open(source_file, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    digest.update(repr(tuple(params)).encode())
+    return digest.hexdigest()
+
+
+def is_stale(target_file, *source_files, params=()):
+    """
+    Checks whether a generated model file needs to be (re)built. The check compares the source
+    digest stored in the model's metadata, so it does not depend on file modification times,
+    which copies made with cp -p, rsync -a or from an archive keep from the original.
+
+    Parameters:
+    target_file (str): The generated file.
+    source_files (str): The files it is generated from.
+    params (tuple): The parameters baked into it.
+
+    Returns:
+    bool: True if the target file is missing or was generated from other sources or parameters.
+    """
+    if not os.path.exists(target_file):
+        return True
+    import onnx
+
+    target = onnx.load(target_file, load_external_data=False)
+    metadata = {prop.key: prop.value for prop in target.metadata_props}
+    return metadata.get('source_sha256') != source_digest(*source_files, params=params)
+
+
+def create_session(model_file):
+    """
+    Creates an ONNX Runtime session tuned for low-latency, single-sample CPU inference.
+
+    The policy networks are small MLPs, so they run on a single thread to avoid thread-pool
+    synchronization on every run. Optimizing their graphs takes only milliseconds, so it is
+    done in memory on every start, and no optimized copy is cached that could outlive its model.
+
+    Parameters:
+    model_file (str): Path of the ONNX model.
+
+    Returns:
+    ort.InferenceSession: The inference session.
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_file, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def fuse_encoder_policy(encoder_file, policy_file, fused_file, clip_observations):
+    """
+    Merges the mlp encoder and the policy into a single ONNX model, so that one session run
+    per control step computes the actions directly from the observation history.
+
+    The fused model takes the observation history as its only input. The encoder is fed the
+    history clipped to [-clip_observations, clip_observations], and the policy is fed the
+    history concatenated with the encoder latent. Both models are converted to a common opset
+    of at least 11, the first opset whose Clip takes its limits as inputs, so that every node
+    keeps the semantics it was exported with.
+
+    The digest of the two models and the clip limit is stored in the fused model's metadata, see is_stale.
+
+    Parameters:
+    encoder_file (str): Path of the encoder ONNX model.
+    policy_file (str): Path of the policy ONNX model.
+    fused_file (str): Path the fused ONNX model is saved to.
+    clip_observations (float): Clip limit applied to the encoder input.
+    """
+    import onnx
+    from onnx import compose, helper, numpy_helper, version_converter
+    import numpy as np
+
+    encoder = onnx.load(encoder_file)
+    policy = onnx.load(policy_file)
+
+    # Convert both models to the same version of the default opset, so that no node is
+    # reinterpreted under an opset it was not exported for
+    def default_opset(model):
+        return next(opset.version for opset in model.opset_import if opset.domain in ('', 'ai.onnx'))
+
+    opset_version = max(11, default_opset(encoder), default_opset(policy))
+    converted = []
+    for model, model_file in ((encoder, encoder_file), (policy, policy_file)):
+        if default_opset(model) != opset_version:
+            try:
+                model = version_converter.convert_version(model, opset_version)
+            except Exception as e:
+                raise ValueError(
+                    f'Cannot convert {model_file} from opset {default_opset(model)} to opset {opset_version} '
+                    f'for fusing, re-export it with opset {opset_version}: {e}'
+                ) from e
+        converted.append(model)
+    encoder, policy = converted
+
+    history_input = encoder.graph.input[0]
+    encoder_output_name = encoder.graph.output[0].name
+    policy_input_name = policy.graph.input[0].name
+    policy_outputs = list(policy.graph.output)
+
+    # Prefix all names so that the two graphs cannot collide once merged
+    encoder = compose.add_prefix(encoder, 'encoder/')
+    policy = compose.add_prefix(policy, 'policy/')
+
+    # Any other domain must be imported at the same version by both models
+    opsets = {'': opset_version}
+    for opset in list(encoder.opset_import) + list(policy.opset_import):
+        if opset.domain in ('', 'ai.onnx'):
+            continue
+        if opsets.setdefault(opset.domain, opset.version) != opset.version:
+            raise ValueError(f'The encoder and the policy import different versions of the opset domain {opset.domain}')
+
+    clip_min = numpy_helper.from_array(np.array(-clip_observations, dtype=np.float32), 'clip_observations_min')
+    clip_max = numpy_helper.from_array(np.array(clip_observations, dtype=np.float32), 'clip_observations_max')
+    nodes = [
+        helper.make_node('Clip', [history_input.name, clip_min.name, clip_max.name], ['encoder/' + history_input.name]),
+        *encoder.graph.node,
+        helper.make_node('Concat', [history_input.name, 'encoder/' + encoder_output_name], ['policy/' + policy_input_name], axis=-1),
+        *policy.graph.node,
+        *[helper.make_node('Identity', ['policy/' + output.name], [output.name]) for output in policy_outputs]
+    ]
+
+    graph = helper.make_graph(
+        nodes,
+        'encoder_policy',
+        [history_input],
+        policy_outputs,
+        initializer=[clip_min, clip_max, *encoder.graph.initializer, *policy.graph.initializer],
+        value_info=[*encoder.graph.value_info, *policy.graph.value_info]
+    )
+    fused = helper.make_model(graph, opset_imports=[helper.make_opsetid(domain, version) for domain, version in opsets.items()])
+    fused.ir_version = max(encoder.ir_version, policy.ir_version)
+    helper.set_model_props(fused, {'source_sha256': source_digest(encoder_file, policy_file, params=(clip_observations,))})
+    onnx.checker.check_model(fused)
+    onnx.save(fused, fused_file)
+
+
+def quantize_model(model_file, quantized_file):
+    """
+    Quantizes the weights of the MatMul and Gemm nodes of an ONNX model to int8. Activations
+    are quantized dynamically at run time, which needs no calibration data. The digest of the
+    float32 model is stored in the quantized model's metadata, see is_stale.
+
+    Parameters:
+    model_file (str): Path of the float32 ONNX model.
+    quantized_file (str): Path the quantized ONNX model is saved to.
+    """
+    import onnx
+    from onnx import helper
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(model_file, quantized_file, weight_type=QuantType.QInt8, op_types_to_quantize=['MatMul', 'Gemm'])
+
+    quantized = onnx.load(quantized_file)
+    metadata = {prop.key: prop.value for prop in quantized.metadata_props}
+    metadata['source_sha256'] = source_digest(model_file)
+    helper.set_model_props(quantized, metadata)
+    onnx.save(quantized, quantized_file)
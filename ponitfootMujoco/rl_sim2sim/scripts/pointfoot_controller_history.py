@@ -1,8 +1,7 @@
 import os
 import sys
-import copy
+import math
 import numpy as np
-import torch
 import yaml
 import onnxruntime as ort
 from scipy.spatial.transform import Rotation as R
@@ -13,10 +12,11 @@ import limxsdk.robot.Robot as Robot
 import limxsdk.robot.RobotType as RobotType
 import limxsdk.datatypes as datatypes
 import time
-from collections import deque
+from observation_utils import fill_observation, read_history
+from onnx_utils import is_stale, quantize_model, create_session
 
 class PointfootController:
-    def __init__(self, model_dir, robot, robot_type):
+    def __init__(self, model_dir, robot, robot_type, quantize=False):
         # Initialize robot and type information
         self.robot = robot
         self.robot_type = robot_type
@@ -24,12 +24,18 @@ class PointfootController:
         self.config_file = f'{model_dir}/{self.robot_type}/params_lab_gait.yaml'
         self.model_file = f'{model_dir}/{self.robot_type}/policy/policy.onnx'
         self.encoder_file = f'{model_dir}/{self.robot_type}/policy/encoder.onnx'
+        self.quantized_model_file = f'{model_dir}/{self.robot_type}/policy/policy.int8.onnx'
 
         # Load configuration settings from the YAML file
         self.load_config(self.config_file)
 
-        # Load the ONNX model of actor-critic and set up input and output names
-        self.policy_session = ort.InferenceSession(self.model_file)
+        # Load the ONNX model of actor-critic, with its weights quantized to int8 if requested, and set up input and output names
+        policy_file = self.model_file
+        if quantize:
+            policy_file = self.quantized_model_file
+            if is_stale(policy_file, self.model_file):
+                quantize_model(self.model_file, policy_file)
+        self.policy_session = create_session(policy_file)
         self.policy_input_names = [self.policy_session.get_inputs()[0].name]
         self.policy_output_names = [self.policy_session.get_outputs()[0].name]
         
@@ -52,15 +58,33 @@ class PointfootController:
         self.robot_state.tau = [0. for x in range(0, self.joint_num)]
         self.robot_state.q = [0. for x in range(0, self.joint_num)]
         self.robot_state.dq = [0. for x in range(0, self.joint_num)]
-        self.robot_state_tmp = copy.deepcopy(self.robot_state)
 
-        # Initialize IMU (Inertial Measurement Unit) data structure
+        # Initialize IMU (Inertial Measurement Unit) data structure, holding the latest message as received,
+        # with its quaternion in (w, x, y, z) order
         self.imu_data = datatypes.ImuData()
-        self.imu_data.quat[0] = 0
+        self.imu_data.quat[0] = 1
         self.imu_data.quat[1] = 0
         self.imu_data.quat[2] = 0
-        self.imu_data.quat[3] = 1
-        self.imu_data_tmp = copy.deepcopy(self.imu_data)
+        self.imu_data.quat[3] = 0
+
+        # Preallocate snapshots of the robot state and IMU data taken at every walk step.
+        # The joint state is stored in the policy's joint order, where joint i of the
+        # policy is joint joint_perm[i] of the robot.
+        self.joint_perm = np.arange(self.joint_num)
+        self.joint_perm[1:5] = [3, 1, 4, 2]
+        self.joint_state_snap = np.zeros((2, self.joint_num))  # joint positions and velocities
+        self.joint_positions_snap = self.joint_state_snap[0]
+        self.joint_velocities_snap = self.joint_state_snap[1]
+        self.imu_quat_snap = np.zeros(4)
+        self.imu_gyro_snap = np.zeros(3)
+        self.joint_cmd_q = np.zeros(self.joint_num)  # desired joint positions in the robot's joint order
+
+        # Mirror the latest robot state and IMU data into arrays, which the callbacks update in place.
+        # The joint positions and velocities share one array, so that each is written and read in a single
+        # copy, and a snapshot never mixes the positions and velocities of different messages.
+        self.robot_qdq = np.zeros((2, self.joint_num))
+        self.imu_quat = np.array([0., 0., 0., 1.])
+        self.imu_gyro = np.zeros(3)
 
         # Set up a callback to receive updated robot state data
         self.robot_state_callback_partial = partial(self.robot_state_callback)
@@ -79,15 +103,52 @@ class PointfootController:
         self.gait_command[1] = 0.5 # Phase offset range [0-1]
         self.gait_command[2] = 0.5 # Contact duration range [0-1]
         
-        # add a deque to store the observation history (FIFO)
-        self.base_ang_vel_queue = deque(maxlen=self.history_length)
-        self.projected_gravity_queue = deque(maxlen=self.history_length)
-        self.joint_positions_queue = deque(maxlen=self.history_length)
-        self.joint_velocities_queue = deque(maxlen=self.history_length)
-        self.actions_queue = deque(maxlen=self.history_length)
-        self.scaled_commands_queue = deque(maxlen=self.history_length)
-        self.gait_phase_queue = deque(maxlen=self.history_length)
-        self.gait_command_queue = deque(maxlen=self.history_length)
+        # Preallocate a ring buffer storing one observation per row (FIFO), with fixed column slices for the
+        # base angular velocity, projected gravity, joint positions, joint velocities, actions, scaled commands,
+        # gait phase and gait command, in the order written by fill_observation
+        obs_dims = [3, 3, self.joint_num, self.joint_num, self.actions_size, 3, 2, 3]
+        obs_bounds = np.cumsum([0] + obs_dims)
+        self.obs_slices = [slice(start, stop) for start, stop in zip(obs_bounds[:-1], obs_bounds[1:])]
+        self.obs_per_step = int(obs_bounds[-1])
+        self.obs_buf = np.zeros((self.history_length, self.obs_per_step), dtype=np.float32)
+        self.history_head = 0  # index of the oldest row, overwritten by the next observation
+
+        # The observations are read out directly into the bound policy input buffer
+        self.policy_input = np.zeros((1, self.obs_buf.size), dtype=np.float32)
+        self.observations = self.policy_input[0]
+
+        # For every write index, precompute the flat indices that read the buffer out
+        # field by field, oldest entry first, which is the layout expected by the policy
+        self.history_index = np.zeros((self.history_length, self.obs_buf.size), dtype=np.int64)
+        for head in range(self.history_length):
+            rows = (head + np.arange(self.history_length)) % self.history_length
+            self.history_index[head] = np.concatenate([
+                (rows[:, None] * self.obs_per_step + np.arange(s.start, s.stop)).ravel() for s in self.obs_slices
+            ])
+
+        # Run the observation kernels once on the preallocated buffers, so that numba compiles them
+        # (or loads them from its cache) here rather than inside the control loop. The history is
+        # overwritten by the first walk observation, so the values written here are never used.
+        fill_observation(
+            self.obs_buf[0], self.imu_quat, self.imu_gyro, self.imu_offset_rot,
+            self.joint_positions_snap, self.joint_velocities_snap, self.init_joint_angles,
+            self.last_actions, self.commands, self.command_scales, self.gait_phase, self.gait_command,
+            self.ang_vel_scale, self.dof_pos_scale, self.dof_vel_scale
+        )
+        read_history(self.obs_buf, self.history_index[0], self.clip_observations, self.observations)
+
+        # Bind the policy input and output to preallocated buffers, so that each session run
+        # reads and writes them in place instead of converting numpy arrays to ONNX tensors
+        self.policy_output = np.zeros((1, self.actions_size), dtype=np.float32)
+        self.policy_binding = self.policy_session.io_binding()
+        self.policy_binding.bind_input(
+            name=self.policy_input_names[0], device_type='cpu', device_id=0, element_type=np.float32,
+            shape=self.policy_input.shape, buffer_ptr=self.policy_input.ctypes.data
+        )
+        self.policy_binding.bind_output(
+            name=self.policy_output_names[0], device_type='cpu', device_id=0, element_type=np.float32,
+            shape=self.policy_output.shape, buffer_ptr=self.policy_output.ctypes.data
+        )
 
     # Load the configuration from a YAML file
     def load_config(self, config_file):
@@ -106,13 +167,14 @@ class PointfootController:
         self.latent_size = config['PointfootCfg']['size']['latent_size']
         self.observations_size = config['PointfootCfg']['size']['observations_size'] * self.history_length + self.latent_size
         self.imu_orientation_offset = np.array(list(config['PointfootCfg']['imu_orientation_offset'].values()))
+        self.imu_offset_rot = R.from_euler('zyx', self.imu_orientation_offset).as_matrix()  # constant IMU mounting rotation
         self.user_cmd_cfg = config['PointfootCfg']['user_cmd_scales']
         self.loop_frequency = config['PointfootCfg']['loop_frequency']
+        self.loop_dt = 1.0 / self.loop_frequency
         self.decimation = config['PointfootCfg']['control']['decimation']
         
         # Initialize variables for actions, observations, and commands
         self.actions = np.zeros(self.actions_size)
-        self.observations = np.zeros(self.observations_size)
         self.last_actions = np.zeros(self.actions_size)
         self.commands = np.zeros(3)  # command to the robot (e.g., velocity, rotation)
         self.scaled_commands = np.zeros(3)
@@ -123,7 +185,9 @@ class PointfootController:
         self.policy_session = None  # ONNX model session for policy inference
         self.encoder_session = None  # ONNX model session for encoder inference
         self.joint_num = len(self.joint_names)  # number of joints
-        self.gait_phase = np.zeros(2)
+        self.gait_indices = 0.0  # gait phase in [0, 1)
+        self.gait_loop_count = 0  # loop count at which the gait phase was last advanced
+        self.gait_phase = np.zeros(2, dtype=np.float32)  # sin/cos of the gait phase, updated in place
         self.gait_command = np.zeros(3)
 
         # Initialize joint angles based on the initial configuration
@@ -131,6 +195,23 @@ class PointfootController:
         for i in range(len(self.joint_names)):
             self.init_joint_angles[i] = self.init_state[self.joint_names[i]]
         
+        # Cache the configuration values used in the control loop
+        self.stiffness = float(self.control_cfg['stiffness'])
+        self.damping = float(self.control_cfg['damping'])
+        self.user_torque_limit = float(self.control_cfg['user_torque_limit'])
+        self.action_scale_pos = float(self.control_cfg['action_scale_pos'])
+        self.decimation = int(self.decimation)
+        self.clip_observations = float(self.rl_cfg['clip_scales']['clip_observations'])
+        self.clip_actions = float(self.rl_cfg['clip_scales']['clip_actions'])
+        self.ang_vel_scale = float(self.obs_scales['ang_vel'])
+        self.dof_pos_scale = float(self.obs_scales['dof_pos'])
+        self.dof_vel_scale = float(self.obs_scales['dof_vel'])
+        self.command_scales = np.array([
+            self.user_cmd_cfg['lin_vel_x'],
+            self.user_cmd_cfg['lin_vel_y'],
+            self.user_cmd_cfg['ang_vel_yaw']
+        ])
+        
         # Set initial mode to "STAND"
         self.mode = "STAND"
 
@@ -138,9 +219,19 @@ class PointfootController:
     def run(self):
         # Initialize default joint angles for standing
         self.default_joint_angles = np.array([0.0] * len(self.joint_names))
-        self.stand_percent += 1 / (self.stand_duration * self.loop_frequency)
+        self.stand_step = 1 / (self.stand_duration * self.loop_frequency)
+        self.stand_percent += self.stand_step
+
+        # Precompute the stand mode interpolation in the robot's joint order, as a start position
+        # and the offset to the initial joint angles, so that each stand step is a single multiply-add
+        self.stand_start_q = np.zeros(self.joint_num)
+        self.stand_start_q[self.joint_perm] = self.default_joint_angles
+        self.stand_offset_q = np.zeros(self.joint_num)
+        self.stand_offset_q[self.joint_perm] = self.init_joint_angles - self.default_joint_angles
         self.mode = "STAND"
         self.loop_count = 0
+        self.gait_indices = 0.0
+        self.gait_loop_count = 0
 
         # Set the loop rate based on the frequency in the configuration
         rate = Rate(self.loop_frequency)
@@ -151,97 +242,105 @@ class PointfootController:
     # Handle the stand mode for smoothly transitioning the robot into standing
     def handle_stand_mode(self):
         if self.stand_percent < 1:
-            for j in range(len(self.joint_names)):
-                # Interpolate between initial and default joint angles during stand mode
-                pos_des = self.default_joint_angles[j] * (1 - self.stand_percent) + self.init_state[self.joint_names[j]] * self.stand_percent
-                self.set_joint_command_aligned(j, pos_des)
+            # Interpolate between initial and default joint angles during stand mode
+            np.multiply(self.stand_offset_q, self.stand_percent, out=self.joint_cmd_q)
+            self.joint_cmd_q += self.stand_start_q
+            self.robot_cmd.q = self.joint_cmd_q.tolist()
             # Increment the stand percentage over time
-            self.stand_percent += 1 / (self.stand_duration * self.loop_frequency)
+            self.stand_percent += self.stand_step
         else:
-            # Switch to walk mode after standing
-            self.mode = "WALK"
-
-    def align_robot_state(self, robot_state: datatypes.RobotState):
-        aligned_robot_state = copy.deepcopy(robot_state)
-        aligned_robot_state.q[1] = robot_state.q[3]
-        aligned_robot_state.dq[1] = robot_state.dq[3]
-        aligned_robot_state.tau[1] = robot_state.tau[3]
-        
-        aligned_robot_state.q[2] = robot_state.q[1]
-        aligned_robot_state.dq[2] = robot_state.dq[1]
-        aligned_robot_state.tau[2] = robot_state.tau[1]
-        
-        aligned_robot_state.q[3] = robot_state.q[4]
-        aligned_robot_state.dq[3] = robot_state.dq[4]
-        aligned_robot_state.tau[3] = robot_state.tau[4]
-        
-        aligned_robot_state.q[4] = robot_state.q[2]
-        aligned_robot_state.dq[4] = robot_state.dq[2]
-        aligned_robot_state.tau[4] = robot_state.tau[2]
-        
-        return aligned_robot_state
-    
+            # Switch to walk mode after standing, starting with an empty history
+            self.mode = "WALK_START"
+
+    def snapshot_state(self):
+        """
+        Snapshots the robot state, aligned to the policy's joint order, and the IMU data.
+        """
+        np.take(self.robot_qdq, self.joint_perm, axis=1, out=self.joint_state_snap)
+        np.copyto(self.imu_quat_snap, self.imu_quat)
+        np.copyto(self.imu_gyro_snap, self.imu_gyro)
+
+    def fill_history(self):
+        """
+        Fills the whole observation history with the latest observation and reads it out again.
+        """
+        self.obs_buf[:] = self.obs_buf[self.history_head - 1]
+        read_history(self.obs_buf, self.history_index[self.history_head], self.clip_observations, self.observations)
+
+    # Handle the first steps of walk mode, until the first observation has been computed
+    def handle_walk_start_mode(self):
+        if self.loop_count % self.decimation != 0:
+            self.handle_walk_mode()
+            return
+
+        # The history is still empty, so fill it with the first observation before computing the actions
+        self.snapshot_state()
+        self.compute_observation()
+        self.fill_history()
+        self.compute_actions()
+        # Clip the actions within predefined limits
+        np.clip(self.actions, -self.clip_actions, self.clip_actions, out=self.actions)
+        self.apply_actions()
+        self.mode = "WALK"
+
     # Handle the walk mode where the robot moves based on computed actions
     def handle_walk_mode(self):
-        # Update the temporary robot state and IMU data
-        self.robot_state_tmp = self.align_robot_state(copy.deepcopy(self.robot_state))
-        self.imu_data_tmp = copy.deepcopy(self.imu_data)
+        # Snapshot the robot state and IMU data
+        self.snapshot_state()
 
         # Execute actions every 'decimation' iterations
-        if self.loop_count % self.control_cfg['decimation'] == 0:
+        if self.loop_count % self.decimation == 0:
             self.compute_observation()
             self.compute_actions()
             # Clip the actions within predefined limits
-            action_min = -self.rl_cfg['clip_scales']['clip_actions']
-            action_max = self.rl_cfg['clip_scales']['clip_actions']
-            self.actions = np.clip(self.actions, action_min, action_max)
-
-        # Iterate over the joints and set commands based on actions
-        joint_pos = np.array(self.robot_state_tmp.q)
-        joint_vel = np.array(self.robot_state_tmp.dq)
-
-        for i in range(len(joint_pos)):
-            # Compute the limits for the action based on joint position and velocity
-            action_min = (joint_pos[i] - self.init_joint_angles[i] +
-                          (self.control_cfg['damping'] * joint_vel[i] - self.control_cfg['user_torque_limit']) /
-                          self.control_cfg['stiffness'])
-            action_max = (joint_pos[i] - self.init_joint_angles[i] +
-                          (self.control_cfg['damping'] * joint_vel[i] + self.control_cfg['user_torque_limit']) /
-                          self.control_cfg['stiffness'])
-
-            # Clip action within limits
-            self.actions[i] = max(action_min / self.control_cfg['action_scale_pos'],
-                                  min(action_max / self.control_cfg['action_scale_pos'], self.actions[i]))
-
-            # Compute the desired joint position and set it
-            pos_des = self.actions[i] * self.control_cfg['action_scale_pos'] + self.init_joint_angles[i]
-            self.set_joint_command_aligned(i, pos_des)
-
-            # Save the last action for reference
-            self.last_actions[i] = self.actions[i]
+            np.clip(self.actions, -self.clip_actions, self.clip_actions, out=self.actions)
+
+        self.apply_actions()
+
+    def apply_actions(self):
+        """
+        Clips the actions to the torque limits at the current joint state and sends them as joint commands.
+        """
+        # Compute the limits for the actions based on joint positions and velocities
+        joint_offset = (self.joint_positions_snap - self.init_joint_angles +
+                        self.damping * self.joint_velocities_snap / self.stiffness)
+        torque_margin = self.user_torque_limit / self.stiffness
+
+        # Clip actions within limits
+        np.clip(self.actions,
+                (joint_offset - torque_margin) / self.action_scale_pos,
+                (joint_offset + torque_margin) / self.action_scale_pos,
+                out=self.actions)
+
+        # Compute the desired joint positions and set them
+        pos_des = self.actions * self.action_scale_pos + self.init_joint_angles
+        self.set_joint_commands_aligned(pos_des)
+
+        # Save the last actions for reference
+        np.copyto(self.last_actions, self.actions)
             
     def compute_gait_phase(self):
         """
         Computes the gait phase based on the current loop count and the gait period.
+        The phase is advanced incrementally, so it keeps full precision however large the loop count grows.
         """
-        # Calculate gait indices
-        gait_indices = torch.remainder(
-            torch.tensor((self.loop_count / self.loop_frequency) * self.gait_command[0], dtype=torch.float32, device='cpu'), 
-            1.0
-        )
+        # Advance the gait indices by the time elapsed since the last call and wrap them to [0, 1)
+        self.gait_indices += (self.loop_count - self.gait_loop_count) * self.loop_dt * self.gait_command[0]
+        self.gait_indices -= math.floor(self.gait_indices)
+        self.gait_loop_count = self.loop_count
         # Convert to sin/cos representation
-        sin_phase = torch.sin(2 * torch.pi * gait_indices)
-        cos_phase = torch.cos(2 * torch.pi * gait_indices)
+        self.gait_phase[0] = math.sin(2 * math.pi * self.gait_indices)
+        self.gait_phase[1] = math.cos(2 * math.pi * self.gait_indices)
         
-        return torch.stack([sin_phase, cos_phase], dim=0)
+        return self.gait_phase
     
     def compute_encoder_latent(self, current_obs):
         '''
         Computes the encoder latent vector based on the current observation.
+        The policy of this controller takes no latent, so the control loop does not call it.
         '''
-        # Concatenate observations into a single tensor and convert to float32
-        input_tensor = np.concatenate([current_obs], axis=0)
-        input_tensor = input_tensor.astype(np.float32).reshape(1,-1)
+        # Convert the observations to a float32 batch of one, copying only if they are not float32 already
+        input_tensor = current_obs.astype(np.float32, copy=False).reshape(1, -1)
         
         # Create a dictionary of inputs for the policy session
         inputs = {self.encoder_input_names[0]: input_tensor}
@@ -258,90 +357,32 @@ class PointfootController:
         Computes the observation based on the current robot state, IMU data, and commands.
         And stores the observation in the history queue.
         '''
-        imu_orientation = np.array(self.imu_data_tmp.quat)
-        q_wi = R.from_quat(imu_orientation).as_euler('zyx')  # Quaternion to Euler ZYX conversion
-        inverse_rot = R.from_euler('zyx', q_wi).inv().as_matrix()  # Get the inverse rotation matrix
-
-        gravity_vector = np.array([0, 0, -1])  # Gravity in world frame
-        projected_gravity = np.dot(inverse_rot, gravity_vector)
-        
-        base_ang_vel = np.array(self.imu_data_tmp.gyro)
-        rot = R.from_euler('zyx', self.imu_orientation_offset).as_matrix()
-        base_ang_vel = np.dot(rot, base_ang_vel)
-        projected_gravity = np.dot(rot, projected_gravity)
-
-        joint_positions = np.array(self.robot_state_tmp.q)
-        joint_velocities = np.array(self.robot_state_tmp.dq)
-
-        actions = np.array(self.last_actions)
-
-        command_scaler = np.diag([
-            self.user_cmd_cfg['lin_vel_x'],
-            self.user_cmd_cfg['lin_vel_y'],
-            self.user_cmd_cfg['ang_vel_yaw']
-        ])
-        scaled_commands = np.dot(command_scaler, self.commands)
-
         gait_phase = self.compute_gait_phase()
-        gait_command = torch.tensor(self.gait_command, dtype=torch.float32)
-
-        # Fill the history queue with the current observation if it is empty
-        while len(self.base_ang_vel_queue) < self.history_length:
-            self.base_ang_vel_queue.append(base_ang_vel * self.obs_scales['ang_vel'])
-            self.projected_gravity_queue.append(projected_gravity)
-            self.joint_positions_queue.append((joint_positions - self.init_joint_angles) * self.obs_scales['dof_pos'])
-            self.joint_velocities_queue.append(joint_velocities * self.obs_scales['dof_vel'])
-            self.actions_queue.append(actions)
-            self.scaled_commands_queue.append(scaled_commands)
-            self.gait_phase_queue.append(gait_phase.cpu().numpy())
-            self.gait_command_queue.append(gait_command.cpu().numpy())
-
-        # Append the current observation to the history queue
-        self.base_ang_vel_queue.append(base_ang_vel * self.obs_scales['ang_vel'])
-        self.projected_gravity_queue.append(projected_gravity)
-        self.joint_positions_queue.append((joint_positions - self.init_joint_angles) * self.obs_scales['dof_pos'])
-        self.joint_velocities_queue.append(joint_velocities * self.obs_scales['dof_vel'])
-        self.actions_queue.append(actions)
-        self.scaled_commands_queue.append(scaled_commands)
-        self.gait_phase_queue.append(gait_phase.cpu().numpy())
-        self.gait_command_queue.append(gait_command.cpu().numpy())
-        
-        history_obs = np.concatenate([
-            np.array(self.base_ang_vel_queue).flatten(),
-            np.array(self.projected_gravity_queue).flatten(),
-            np.array(self.joint_positions_queue).flatten(),
-            np.array(self.joint_velocities_queue).flatten(),
-            np.array(self.actions_queue).flatten(),
-            np.array(self.scaled_commands_queue).flatten(),
-            np.array(self.gait_phase_queue).flatten(),
-            np.array(self.gait_command_queue).flatten()
-        ])
-        
-        observations = np.clip(
-            history_obs,
-            -self.rl_cfg['clip_scales']['clip_observations'],
-            self.rl_cfg['clip_scales']['clip_observations']
+
+        # Write the current observation into the oldest row of the history buffer
+        row = self.obs_buf[self.history_head]
+        fill_observation(
+            row, self.imu_quat_snap, self.imu_gyro_snap, self.imu_offset_rot,
+            self.joint_positions_snap, self.joint_velocities_snap, self.init_joint_angles,
+            self.last_actions, self.commands, self.command_scales, gait_phase, self.gait_command,
+            self.ang_vel_scale, self.dof_pos_scale, self.dof_vel_scale
         )
-        
-        self.observations = observations
+        self.history_head = (self.history_head + 1) % self.history_length
+
+        # Read out the history field by field, oldest entry first
+        read_history(self.obs_buf, self.history_index[self.history_head], self.clip_observations, self.observations)
         
     
     def compute_actions(self):
         """
         Computes the actions based on the current observations using the policy session.
         """
-        # Concatenate observations into a single tensor and convert to float32
-        input_tensor = np.concatenate([self.observations], axis=0)
-        input_tensor = input_tensor.astype(np.float32).reshape(1,-1)
+        # Run the policy session on the observations, which are already in the bound input buffer,
+        # and let it write the bound output buffer in place
+        self.policy_session.run_with_iobinding(self.policy_binding)
         
-        # Create a dictionary of inputs for the policy session
-        inputs = {self.policy_input_names[0]: input_tensor}
-        
-        # Run the policy session and get the output
-        output = self.policy_session.run(self.policy_output_names, inputs)
-        
-        # Flatten the output and store it as actions
-        self.actions = np.array(output).flatten()
+        # Store the output as actions
+        np.copyto(self.actions, self.policy_output[0])
         
     def set_joint_command(self, joint_index, position):
         """
@@ -354,18 +395,15 @@ class PointfootController:
         """
         self.robot_cmd.q[joint_index] = position
         
-    def set_joint_command_aligned(self, joint_index, position):
+    def set_joint_commands_aligned(self, positions):
+        """
+        Sends a command to set all joints to the desired positions, given in the policy's joint order.
         
-        if joint_index == 2:
-            self.robot_cmd.q[1] = position
-        elif joint_index == 4:
-            self.robot_cmd.q[2] = position
-        elif joint_index == 1:
-            self.robot_cmd.q[3] = position
-        elif joint_index == 3:
-            self.robot_cmd.q[4] = position
-        else:
-            self.robot_cmd.q[joint_index] = position
+        Parameters:
+        positions (np.ndarray): The desired positions of the joints, in the policy's joint order.
+        """
+        self.joint_cmd_q[self.joint_perm] = positions
+        self.robot_cmd.q = self.joint_cmd_q.tolist()
 
     def update(self):
         """
@@ -373,6 +411,8 @@ class PointfootController:
         """
         if self.mode == "STAND":
             self.handle_stand_mode()
+        elif self.mode == "WALK_START":
+            self.handle_walk_start_mode()
         elif self.mode == "WALK":
             self.handle_walk_mode()
         
@@ -391,6 +431,7 @@ class PointfootController:
         robot_state (datatypes.RobotState): The current state of the robot.
         """
         self.robot_state = robot_state
+        np.copyto(self.robot_qdq, (robot_state.q, robot_state.dq))
 
     # Callback function for receiving imu data
     def imu_data_callback(self, imu_data: datatypes.ImuData):
@@ -400,15 +441,12 @@ class PointfootController:
         Parameters:
         imu_data (datatypes.ImuData): The IMU data containing stamp, acceleration, gyro, and quaternion.
         """
-        self.imu_data.stamp = imu_data.stamp
-        self.imu_data.acc = imu_data.acc
-        self.imu_data.gyro = imu_data.gyro
+        self.imu_data = imu_data
         
-        # Rotate quaternion values
-        self.imu_data.quat[0] = imu_data.quat[1]
-        self.imu_data.quat[1] = imu_data.quat[2]
-        self.imu_data.quat[2] = imu_data.quat[3]
-        self.imu_data.quat[3] = imu_data.quat[0]
+        # Rotate quaternion values from (w, x, y, z) to (x, y, z, w), reading the quaternion list only once
+        quat = imu_data.quat
+        self.imu_quat[:] = (quat[1], quat[2], quat[3], quat[0])
+        np.copyto(self.imu_gyro, imu_data.gyro)
 
     # Callback function for receiving sensor joy data
     def sensor_joy_callback(self, sensor_joy: datatypes.SensorJoy):